@@ -4,11 +4,10 @@ It passes information between the user and the viewmodel.
 """
 
 import sys
-from os import path
-import sounddevice as sd
+import time
+import functools
 from controller import Controller
 from experiment import TransducerPair
-from datetime import datetime
 
 
 # PRINT FORMATTING
@@ -16,68 +15,79 @@ tab = '> '                      # tab-ish
 ln = '\n'                       # new line
 divider = '---------------'     # divider
 
+# SECTION HEADERS
+welcome_header = f'{ln}{divider} Welcome to VibePy! {divider}{ln}'
+general_header = f'{ln}GENERAL EXPERIMENT PARAMETERS {divider}{ln}'
+hardware_header = f'{ln}HARDWARE PARAMETERS {divider}{ln}'
+stimulus_header = f'{ln}STIMULUS & SIGNAL PARAMETERS {divider}{ln}'
+description_header = f'{ln}{divider} Experiment Description {divider}{ln}'
+compensate_header = (f'{ln}{divider} Measuring and compensating for unwanted '
+                     f'filtering{divider}{ln}')
+calibrate_header = f'{ln}{divider} Calibrating amplitude {divider}{ln}'
+playback_header = f'{ln}{divider} Playing vibrational stimulus {divider}{ln}'
+
+# ANSWERS THAT MEAN YES, AND ALL YES/NO ANSWERS
+yes = frozenset('yY')
+yes_no = frozenset('yYnN')
+
+# SENSOR MENU AND LOOKUPS
+sensor_menu = '\n'.join(f'{x.number}. {x.name}'
+                        for x in TransducerPair.sensor_options)
+sensor_types = tuple(x.name for x in TransducerPair.sensor_options)
+sensor_units = tuple(x.units for x in TransducerPair.sensor_options)
+
+# PARAMETERS FILE ENTRIES AND THEIR TYPES
+testing_parameter_types = [
+    ('input_device_num', int),
+    ('output_device_num', int),
+    ('input_channel', int),
+    ('output_channel', int),
+    ('sensor_number', int),
+    ('stimulus_filename', str),
+    ('fs', int),
+    ('fft', int),
+    ('low_freq', int),
+    ('high_freq', int),
+    ('target_amp', float),
+]
+
 
 def main():
-    print(f'{ln}{divider} Welcome to VibePy! {divider}{ln}')
+    print(welcome_header)
     
-    print(f'{ln}GENERAL EXPERIMENT PARAMETERS {divider}{ln}')
+    print(general_header)
     # Initialize experiment
     experiment_name = request_experiment_name()
     compensate, calibrate, playback = request_experiment_actions()
-    controller = Controller(experiment_name)
     
-    provide_param_file = request_provide_param_file()
-    
-    if provide_param_file:
+    source = None
+    if request_provide_param_file():
         param_file_name = request_param_file_name()
         
         # Get parameters from a file
-        if not path.exists(param_file_name):
+        try:
+            source = FileSource(param_file_name)
+        except FileNotFoundError:
             print(f'{ln}{param_file_name} does not exist. Enter parameters below. ')
-            provide_param_file = False
-        else:
-            input_device_num = int(get_testing_parameter(param_file_name, 'input_device_num'))
-            output_device_num = int(get_testing_parameter(param_file_name, 'output_device_num'))
-            device_num = (input_device_num, output_device_num)
-            controller.add_audiointerface(device_num)
-
-            input_channel = int(get_testing_parameter(param_file_name, 'input_channel'))
-            output_channel = int(get_testing_parameter(param_file_name, 'output_channel'))
-            sensor_number = int(get_testing_parameter(param_file_name, 'sensor_number'))
-            sensor_type = get_sensor_type(sensor_number)
-            controller.add_transducers(input_channel, output_channel, sensor_type)
-
-            stimulus_filename = get_testing_parameter(param_file_name, 'stimulus_filename')
-            fs = int(get_testing_parameter(param_file_name, 'fs'))
-            fft = int(get_testing_parameter(param_file_name, 'fft'))
-            low_freq = int(get_testing_parameter(param_file_name, 'low_freq'))
-            high_freq = int(get_testing_parameter(param_file_name, 'high_freq'))
-            target_amp = float(get_testing_parameter(param_file_name, 'target_amp'))
-            controller.add_stimulus(stimulus_filename, fs, fft,
-                                    low_freq, high_freq, target_amp)
+        except (OSError, ValueError) as exc:
+            print(f'{ln}Error reading {param_file_name}: {exc}. '
+                  'Enter parameters below. ')
 
     # Get parameters from user
-    if not provide_param_file:
-        print(f'{ln}HARDWARE PARAMETERS {divider}{ln}')
-        input_device_num, output_device_num = request_audiointerface()
-        device_num = (input_device_num, output_device_num)
-        controller.add_audiointerface(device_num)
+    if source is None:
+        source = InteractiveSource()
 
-        input_channel = request_input_channel(input_device_num)
-        output_channel = request_output_channel(output_device_num)
-        sensor_number = request_sensor()
-        sensor_type = get_sensor_type(sensor_number)
-        sensor_amp_units = get_sensor_units(sensor_number)
-        controller.add_transducers(input_channel, output_channel, sensor_type)
+    # Collect every parameter before setting up the experiment
+    device_num = source.get_audiointerface()
+    transducers = source.get_transducers()
+    stimulus = source.get_stimulus(calibrate)
 
-        print(f'{ln}STIMULUS & SIGNAL PARAMETERS {divider}{ln}')
-        stimulus_filename = request_simulus_file()
-        fs, fft, low_freq, high_freq, target_amp = \
-            request_signal_parameters(sensor_amp_units, calibrate)
-        controller.add_stimulus(stimulus_filename, fs, fft,
-                                low_freq, high_freq, target_amp)
+    controller = Controller(experiment_name)
+    controller.add_audiointerface(device_num)
+    controller.add_transducers(*transducers)
+    controller.add_stimulus(*stimulus)
 
-    print(f'{ln}{divider} Experiment Description {divider}{ln}')
+    print(description_header)
     print(controller.get_experiment())
 
     if continue_request() is not True:
@@ -85,35 +95,107 @@ def main():
         sys.exit()
 
     if compensate: 
-        print(f'{ln}{divider} Measuring and compensating for unwanted filtering'
-              f'{divider}{ln}')
+        print(compensate_header)
         controller.get_compensation_filter()
 
     if calibrate:
-        print(f'{ln}{divider} Calibrating amplitude {divider}{ln}')
+        print(calibrate_header)
         controller.get_calibration_multiplier()
     
     if playback:
-        print(f'{ln}{divider} Playing vibrational stimulus {divider}{ln}')
+        print(playback_header)
         controller.play_stimulus()
 
 
+class FileSource:
+    """
+    FileSource
+    Provides the experiment parameters saved in a parameters file.
+    """
+    def __init__(self, file_name):
+        load_testing_parameters(file_name)  # Raises if the file doesn't exist
+        self.params = {name: cast(get_testing_parameter(file_name, name))
+                       for name, cast in testing_parameter_types}
+
+    def get_audiointerface(self):
+        return self.params['input_device_num'], self.params['output_device_num']
+
+    def get_transducers(self):
+        sensor_type = get_sensor_type(self.params['sensor_number'])
+        return (self.params['input_channel'], self.params['output_channel'],
+                sensor_type)
+
+    def get_stimulus(self, do_calibrate):
+        return (self.params['stimulus_filename'], self.params['fs'],
+                self.params['fft'], self.params['low_freq'],
+                self.params['high_freq'], self.params['target_amp'])
+
+
+class InteractiveSource:
+    """
+    InteractiveSource
+    Provides the experiment parameters by asking the user for them.
+    """
+    def __init__(self):
+        self.device_num = None
+        self.sensor_amp_units = None
+
+    def get_audiointerface(self):
+        self.device_num = request_audiointerface()
+        return self.device_num
+
+    def get_transducers(self):
+        input_device_num, output_device_num = self.device_num
+        input_channel = request_input_channel(input_device_num)
+        output_channel = request_output_channel(output_device_num)
+        sensor_number = request_sensor()
+        sensor_type = get_sensor_type(sensor_number)
+        self.sensor_amp_units = get_sensor_units(sensor_number)
+        return input_channel, output_channel, sensor_type
+
+    def get_stimulus(self, do_calibrate):
+        print(stimulus_header)
+        stimulus_filename = request_simulus_file()
+        fs, fft, low_freq, high_freq, target_amp = \
+            request_signal_parameters(self.sensor_amp_units, do_calibrate)
+        return stimulus_filename, fs, fft, low_freq, high_freq, target_amp
+
+
+def ask(prompt):
+    """
+    ask
+    Prompts the user and returns their answer, like input(). When stdin is not
+    a terminal (e.g. piped or scripted runs), reads the line directly and skips
+    readline's line-editing overhead.
+    """
+    if sys.stdin.isatty():
+        return input(prompt)
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    return sys.stdin.readline().rstrip('\n')
+
+
 def request_experiment_name():
-    experiment_name = input(f'Experiment name: ')
-    if experiment_name == "":
-        experiment_name = datetime.now().strftime("%d%m%Y %H: %M: %S")
-    return experiment_name
+    experiment_name = ask(f'Experiment name: ')
+    return experiment_name or time.strftime('%d%m%Y_%H%M%S')
 
 
 def request_experiment_actions():
-    print(f'{ln}Do you want to... (y/n)')
-    compensate = input(f'{tab}Measure and compensate for unwanted filtering? ')
-    calibrate = input(f'{tab}Calibrate playback amplitude? ')
-    playback = input(f'{tab}Play vibrational stimuli? ')
+    print(f'{ln}Do you want to... (y or n for each)')
+    # All three answers can be given at once as three letters (e.g. ynn),
+    # which helps scripted runs. Otherwise, ask for each one.
+    actions = ask(f'{tab}Compensate, calibrate, playback (e.g. ynn, or '
+                    'press enter to answer each)? ')
+    if len(actions) == 3 and yes_no.issuperset(actions):
+        compensate, calibrate, playback = actions[0], actions[1], actions[2]
+    else:
+        compensate = ask(f'{tab}Measure and compensate for unwanted filtering? ')
+        calibrate = ask(f'{tab}Calibrate playback amplitude? ')
+        playback = ask(f'{tab}Play vibrational stimuli? ')
 
-    compensate = compensate.lower() == 'y'
-    calibrate = calibrate.lower() == 'y'
-    playback = playback.lower() == 'y'
+    compensate = compensate[:1] in yes
+    calibrate = calibrate[:1] in yes
+    playback = playback[:1] in yes
 
     # if compensate:
     #     print("compensate", compensate)
@@ -125,58 +207,86 @@ def request_experiment_actions():
     return compensate, calibrate, playback
 
 def request_provide_param_file():
-    provide_param_file = input(f'{ln}Do you want to use a saved parameters file?: ')
-    provide_param_file = provide_param_file.lower() == 'y'
+    provide_param_file = ask(f'{ln}Do you want to use a saved parameters file?: ')
+    provide_param_file = provide_param_file[:1] in yes
     return provide_param_file
 
 def request_param_file_name():
-    param_file_name = input(f'Parameters file name: ')
+    param_file_name = ask(f'Parameters file name: ')
     return param_file_name
 
+@functools.lru_cache(maxsize=1)
+def get_devices():
+    """
+    Query the audio devices once and reuse the result. Enumerating devices can
+    be slow. To rescan (e.g. after a hotplug), clear the caches of
+    get_devices, get_device_list and get_hardware_menu.
+    """
+    import sounddevice as sd    # Deferred: importing initializes PortAudio
+    return sd.query_devices()
+
+
+@functools.lru_cache(maxsize=1)
+def get_device_list():
+    """
+    Format the list of audio devices once for printing.
+    """
+    return str(get_devices())
+
+
+@functools.lru_cache(maxsize=1)
+def get_hardware_menu():
+    """
+    Assemble the hardware section (header, device list and instructions) once,
+    so that it can be printed with a single write.
+    """
+    return (f'{hardware_header}\n'
+            f'Find your audio device(s) below...\n{get_device_list()}\n'
+            f'{ln}If you are using the same device for input and output'
+            ' (e.g. audio interface), enter that number for both.\n')
+
+
 def request_audiointerface():
-    print(f'Find your audio device(s) below...\n', sd.query_devices())
-    print(f'{ln}If you are using the same device for input and output'
-          ' (e.g. audio interface), enter that number for both.')
-    input_device_num = int(input(f'{ln}Input device number: '))
-    output_device_num = int(input(f'Output device number: '))
+    print(get_hardware_menu(), end='')
+    input_device_num = int(ask(f'{ln}Input device number: '))
+    output_device_num = int(ask(f'Output device number: '))
     return input_device_num, output_device_num
 
 
 def request_output_channel(output_device_num):
-    max_out = sd.query_devices()[output_device_num].get('max_output_channels')
-    output_channel = int(input(f'{tab}Playback device channel ({max_out} available): '))
+    max_out = get_devices()[output_device_num].get('max_output_channels')
+    output_channel = int(ask(f'{tab}Playback device channel ({max_out} available): '))
     return output_channel
 
 
 def request_input_channel(input_device_num):
-    max_in = sd.query_devices()[input_device_num].get('max_input_channels')
-    input_channel = int(input(f'{ln}{tab}Sensor channel ({max_in} available): '))
+    max_in = get_devices()[input_device_num].get('max_input_channels')
+    input_channel = int(ask(f'{ln}{tab}Sensor channel ({max_in} available): '))
     return input_channel
 
 
 def request_sensor():
     print(f'{ln}Find the sensor type you are using below...')
-    print('\n'.join([str(x[0]) + ". " + x[1]
-                     for x in TransducerPair.sensor_options]))
+    print(sensor_menu)
 
-    sensor_number = int(input(f'{ln}{tab}Enter sensor type number: '))
+    sensor_number = int(ask(f'{ln}{tab}Enter sensor type number: '))
     return sensor_number
 
 
 def request_simulus_file():
-    return input(f'Enter the name of playback stimulus file: ')
+    return ask(f'Enter the name of playback stimulus file: ')
 
 
 def request_signal_parameters(sensor_amp_units, do_calibrate):
     print(f'{ln}Enter signal parameters of the playback stimulus...')
-    fs = int(input(f'{tab}sampling rate: '))
-    fft = int(input(f'{tab}fft size: '))
-    low_freq = int(input(f'{tab}low frequency: '))
-    high_freq = int(input(f'{tab}high frequency: '))
+    fs = int(ask(f'{tab}sampling rate: '))
+    fft = int(ask(f'{tab}fft size: '))
+    low_freq = int(ask(f'{tab}low frequency: '))
+    high_freq = int(ask(f'{tab}high frequency: '))
 
     if do_calibrate:
         target_amp = float(
-            input(f'{tab}target amplitude in {sensor_amp_units}: '))
+            ask(f'{tab}target amplitude in {sensor_amp_units}: '))
     else:
         target_amp = None
 
@@ -184,40 +294,55 @@ def request_signal_parameters(sensor_amp_units, do_calibrate):
 
 
 def get_sensor_type(sensor_number):
-    return TransducerPair.sensor_options[sensor_number][1]
+    return sensor_types[sensor_number]
 
 
 def get_sensor_units(sensor_number):
-    return TransducerPair.sensor_options[sensor_number][2]
+    return sensor_units[sensor_number]
 
 
 def continue_request():
-    cont = input(f'{ln}Do you want to continue? (y/n) ')
-    return cont.lower() == 'y'
+    cont = ask(f'{ln}Do you want to continue? (y/n) ')
+    return cont[:1] in yes
+
+
+@functools.lru_cache(maxsize=None)
+def load_testing_parameters(file_name):
+    """
+    Read a parameters file once and return its `name = value` lines as a dict.
+    """
+    with open(file_name, 'rb') as file:
+        data = file.read()
+
+    # Work on bytes and only decode the parameter lines
+    parameters = {}
+    for line in data.splitlines():
+        parts = line.split(b' ', 2)
+        if (len(parts) < 3 or parts[1] != b'=' or not parts[0]
+                or parts[0].startswith(b'#')):
+            continue    # Not a `name = value` line, or commented out
+        parameter_name, _, rhs = parts
+        # Keep the first occurrence of a parameter, as before
+        parameters.setdefault(parameter_name.decode(), rhs.rstrip().decode())
+
+    return parameters
 
 
 def get_testing_parameter(file_name, parameter):
 
     try:
-        with open(file_name) as file:
-
-            for line in file:
-                try:
-                    parameter_name, _, rhs = line.split(' ')
-                    if parameter_name == parameter:
-                        return rhs.replace('\n', '')
-                except Exception as exc:
-                    pass
-
-            # Reached end of file. Complain!
-            print(f'Could not find {parameter} in testing_parameters.txt.\n'
-                  'Add a new line to testing_parmaeters.txt as '
-                  f'{parameter} = your value.', file=sys.stderr)
-
-    except Exception as exc:
+        parameters = load_testing_parameters(file_name)
+    except (OSError, ValueError) as exc:
         print(f'Error reading {file_name}: {exc}', file=sys.stderr)
+        return 0    # There was an error
+
+    if parameter not in parameters:
+        print(f'Could not find {parameter} in testing_parameters.txt.\n'
+              'Add a new line to testing_parmaeters.txt as '
+              f'{parameter} = your value.', file=sys.stderr)
+        return 0    # Requested param wasn't found
 
-    return 0    # Requested param wasn't found or there was an error
+    return parameters[parameter]
             
 
 if __name__ == "__main__":
@@ -6,38 +6,22 @@ target amplitude, and applies that multiplier to the stimulus.
 
 import soundfile as sf
 import os
+import functools
 import numpy as np
 from scipy import signal
+from scipy import fft as sp_fft
 from playback import play_and_record
 from plotting import plot_waveforms, plot_amplitude_spectra
 
 
-def generate_click(fs):
+def find_delay(reference, recording):
     """
-    generate_click
-    Uses the signal parameters provided by the user to generate 2 seconds of
-    flat noise.
+    find_delay
+    Returns the sample in the recording where the reference starts, from the
+    peak of their (FFT-based) cross-correlation.
     """
-    click = np.zeros(2 * fs)   
-    click[round(len(click)/2)] = 1
-    return click
-
-
-def get_time_delay(fs, device, input_channel, output_channel):
-    """
-    get_time_delay
-    Calculates the time delay by playing and recording a click.
-    """
-    # get click
-    click = generate_click(fs)
-    # play and record click
-    recorded_click = play_and_record(
-        click, fs, device, input_channel, output_channel,
-        with_padding=True)
-
-    # get time delay
-    time_delay = np.argmax(recorded_click)-fs
-    return time_delay
+    correlation = signal.fftconvolve(recording, reference[::-1], mode='full')
+    return int(np.argmax(np.abs(correlation))) - (len(reference) - 1)
 
 
 def get_peak_amplitude(recording, amp_conversion, time_delay):
@@ -48,11 +32,11 @@ def get_peak_amplitude(recording, amp_conversion, time_delay):
     may not be at the exact location of the peak in the original stimulus.
     """
     # Finds peak location in playback
-    recording_peak_location = \
-        int(np.where(abs(recording) == max(abs(recording)))[0][0])
+    abs_recording = np.abs(recording)
+    recording_peak_location = int(abs_recording.argmax())
     playback_peak_location = recording_peak_location - time_delay
     # Calculates peak amplitude in engineering units
-    recording_peak_amp = amp_conversion * max(abs(recording))
+    recording_peak_amp = amp_conversion * abs_recording[recording_peak_location]
     return playback_peak_location, recording_peak_amp
 
 
@@ -67,19 +51,22 @@ def get_peak_segment(playback, peak_location, segment_size):
                        peak_location+round(segment_size/2)]
 
     # Apply a tapered window to the segment
-    segment = segment * get_tapered_window(
-        len(segment), round(segment_size / 8))
+    segment = np.multiply(segment, get_tapered_window(
+        len(segment), round(segment_size / 8)), dtype=segment.dtype)
     return segment
 
 
+@functools.lru_cache(maxsize=8)
 def get_tapered_window(win_len, taper_len):
     """
     Create and return a rect window that's gradually tapered at the ends.
+    Windows are cached and shared between calls, so they are read-only.
     """
-    window = np.ones(win_len)
-    ramp = np.linspace(0, np.pi, taper_len)
-    window[0:taper_len] = 0.5 * np.sin(ramp - np.pi / 2) + 0.5
-    window[win_len - taper_len:win_len] = 0.5 * np.cos(ramp) + 0.5
+    # A Tukey window is a rect window with raised-cosine ends. This fraction
+    # makes each ramp `taper_len` samples long, from 0 to 1
+    alpha = 2 * (taper_len - 1) / max(win_len - 1, 1)
+    window = signal.windows.tukey(win_len, alpha)
+    window.flags.writeable = False
 
     return window
 
@@ -95,32 +82,30 @@ def generate_ladder(fs, segment, segment_size,
     # Calculate the maximum amplitude of the ladder (which should be greater
     # than the peak).
     # get the max amp of segment
-    segment_max = max(abs(segment))  # isn't this the same as peak?
+    segment_max = np.abs(segment).max()  # isn't this the same as peak?
     # ensures that the step amps go above the max amp
     step_max = 1.25 * segment_max / (recording_peak_amp / target_peak_amp)
 
     # Create a vector of amplitude multipliers
-    steps = np.linspace(0.01, step_max, 20)
-
-    # Create the ladder of segments with increasing amplitude
-    ladder_of_segments = np.concatenate([
-        np.multiply(step, segment)
-        for step in steps
-    ])
-    # Save the start x value and end x value of each ramp
-    segment_locations = np.asarray([
-        [step_idx * segment_size + 1, (step_idx + 1) * segment_size]
-        for step_idx in range(len(steps))
-    ], dtype=int)
-
-    # Add silence to the beginning and end of the noise
-    padding = np.zeros(round(fs))
-    playback_ladder = np.concatenate([
-        padding, ladder_of_segments, padding
-    ])
-
-    # Update the start and end locations of the segments to account for padding
-    segment_locations += len(padding)
+    steps = np.linspace(0.01, step_max, 20, dtype=segment.dtype)
+
+    # Create the ladder of segments with increasing amplitude, with silence
+    # at the beginning and end. The outer product of the steps and the segment
+    # is written straight into the (steps x segment) view of the ladder
+    padding_len = round(fs)
+    ladder_len = len(steps) * len(segment)
+    playback_ladder = np.zeros(ladder_len + 2 * padding_len,
+                               dtype=segment.dtype)
+    np.multiply(steps[:, np.newaxis], segment,
+                out=playback_ladder[padding_len:padding_len + ladder_len]
+                .reshape(len(steps), len(segment)))
+
+    # Save the start x value and end x value of each ramp, accounting for the
+    # padding
+    step_idx = np.arange(len(steps))
+    segment_locations = np.column_stack([step_idx * segment_size + 1,
+                                         (step_idx + 1) * segment_size])
+    segment_locations += padding_len
 
     return steps, playback_ladder, segment_locations
 
@@ -129,12 +114,19 @@ def find_peaks(recording_of_ladder, recording_segment_locations,
                amp_conversion):
     """
     find_peaks
-    Returns a list of the peak amplitude in each segment
+    Returns an array of the peak amplitude in each segment
     """
-    return [
-        amp_conversion * max(abs(recording_of_ladder[start:end]))
-        for start, end in recording_segment_locations
-    ]
+    # Find the maximum and minimum between each start and end with reduceat,
+    # working on a view of the ladder so that no |ladder| copy is made. The
+    # even entries of the results are the segments; the odd ones are the gaps
+    # between them
+    first = recording_segment_locations[0, 0]
+    last = recording_segment_locations[-1, 1]
+    ladder = recording_of_ladder[first:last]
+    bounds = (recording_segment_locations - first).ravel()[:-1]
+    segment_max = np.maximum.reduceat(ladder, bounds)[::2]
+    segment_min = np.minimum.reduceat(ladder, bounds)[::2]
+    return amp_conversion * np.maximum(segment_max, -segment_min)
 
 def get_amplitude_spectrum(sound, fs, nfft, lo_hi=None):
     """
@@ -143,15 +135,17 @@ def get_amplitude_spectrum(sound, fs, nfft, lo_hi=None):
     """
     # `frequencies` is frequency samples of amplitude spectrum
     # `amplitudes` is power spectral density of amplitude spectrum
-    frequencies, amplitudes = signal.welch(
-        sound, fs, window='hamming',
-        nperseg=nfft, scaling='spectrum', detrend=False)
+    # (the FFTs of the segments run on every core)
+    with sp_fft.set_workers(-1):
+        frequencies, amplitudes = signal.welch(
+            sound, fs, window='hamming',
+            nperseg=nfft, scaling='spectrum', detrend=False)
 
     if lo_hi is not None:   # Limit bandwidth, if requested
         frequencies = frequencies[lo_hi[0]:lo_hi[1]]
         amplitudes = amplitudes[lo_hi[0]:lo_hi[1]]
 
-    return frequencies, np.power(amplitudes, 0.5)
+    return frequencies, np.sqrt(amplitudes)
 
 def frequency2samples(freq, fs, fft):
     """
@@ -164,21 +158,22 @@ def main(fs, original_filename, device_num, input_channel, output_channel,
          filename, target_amp, amp_conversion, fft, low_freq, high_freq):
 
     print(f'Calibrating {filename}')
-    original_stimulus, original_fs = sf.read(original_filename)
-    playback, playback_fs = sf.read(filename)
+    # Audio is read as float32, which halves the memory traffic of float64
+    original_stimulus, original_fs = sf.read(original_filename, dtype='float32')
+    playback, playback_fs = sf.read(filename, dtype='float32')
 
     # convert the units of low and high frequency from Hz to samples
     lo = frequency2samples(low_freq, fs, fft)
     hi = frequency2samples(high_freq, fs, fft)
 
-    # calculate the time delay between the playback and recording
-    time_delay = get_time_delay(fs, device_num, input_channel, output_channel)
-
     # play and record the compensated stimulus
     recording = play_and_record(
         playback, fs, device_num, input_channel, output_channel,
         with_padding=True)  # play filtered stimulus and record
 
+    # calculate the time delay between the playback and recording
+    time_delay = find_delay(playback, recording)
+
     # determine the peak amplitude in the recording and find its location in
     # the playback
     playback_peak_location, recording_peak_amp = \
@@ -219,14 +214,15 @@ def main(fs, original_filename, device_num, input_channel, output_channel,
         calibrated_playback, fs, device_num, input_channel, output_channel,
         with_padding=True)
 
-    # Convert amplitude
+    # Convert amplitude. The recording isn't needed in its raw units again, so
+    # convert it in place
     stim1 = original_stimulus * amp_conversion # stimulus
-    stim2 = recording_of_calibrated_playback * amp_conversion # recording of calibrated stimylus
-    stim3 = calibrated_playback * amp_conversion # calibrated stimulus
-    amp_adjusted_stim1 = stim1 * (max(stim2)/max(stim1)) # equalize amplitudes to facilitate comparison of spectra
+    stim2 = recording_of_calibrated_playback # recording of calibrated stimylus
+    stim2 *= amp_conversion
+    amp_adjusted_stim1 = stim1 * (stim2.max()/stim1.max()) # equalize amplitudes to facilitate comparison of spectra
 
     # Determine peak
-    measured_peak2 = round(max(abs(stim2)), 2)
+    measured_peak2 = round(np.abs(stim2).max(), 2)
     diff = round(20*np.log10(measured_peak2/target_amp),1)
 
     # Plot
@@ -253,7 +249,7 @@ def main(fs, original_filename, device_num, input_channel, output_channel,
     sf.write(calibrated_filename, calibrated_playback, fs)
 
     # check for clipping
-    if max(abs(calibrated_playback)>=1):
+    if np.abs(calibrated_playback).max() >= 1:
         clipping_message = """NOTE: the saved stimulus file is clipped. 
             Consider re-running the compensation & calibration procedure after increasing 
             the amplifier gain or lowering the target amplitude."""
@@ -7,11 +7,15 @@ and applies the compensation filter to the stimulus.
 import numpy as np
 import soundfile as sf
 from scipy import signal
+from scipy import fft as sp_fft
 import os
 from playback import play_and_record
 from plotting import plot_waveforms, plot_amplitude_spectra
 from calibration import get_tapered_window
 
+# Random number generator for the noise (PCG64, faster than the legacy one)
+rng = np.random.default_rng()
+
 
 def generate_noise(fs):
     """
@@ -19,42 +23,52 @@ def generate_noise(fs):
     Uses the signal parameters provided by the user to generate 2 seconds of
     white noise.
     """
-    # Create 2 seconds of white noise
-    white_noise = np.random.rand(2 * fs) - 0.5
-
-    # Apply a tapered window to the noise
-    white_noise = white_noise * get_tapered_window(
-        len(white_noise), round(fs/5))
-
-    # Add silence to the beginning and end of the noise
-    padding = np.zeros(round(fs/6))
-    noise = np.concatenate([
-        padding,
-        np.multiply(white_noise, 0.5),
-        padding,
-        padding,
-        padding
-    ])
+    # Create 2 seconds of white noise, centred on zero in place
+    white_noise = rng.random(2 * fs, dtype=np.float32)
+    white_noise -= 0.5
+
+    # Add silence to the beginning and end of the noise: allocate the whole
+    # output once, with one padding before the noise and three after it
+    padding_len = round(fs/6)
+    noise = np.zeros(len(white_noise) + 4 * padding_len, dtype=np.float32)
+
+    # Apply a tapered window to the noise, at half amplitude, writing it
+    # straight into its place in the output
+    windowed_noise = noise[padding_len:padding_len + len(white_noise)]
+    np.multiply(white_noise, get_tapered_window(len(white_noise), round(fs/5)),
+                out=windowed_noise)
+    windowed_noise *= 0.5
 
     return noise
 
 
-def get_amplitude_spectrum(sound, fs, nfft, lo_hi=None):
+def get_power_spectrum(sound, fs, nfft, lo_hi=None):
     """
-    get_amplitude_spectrum
-    Generates an amplitude spectrum of a selection of sound.
+    get_power_spectrum
+    Generates a power spectrum of a selection of sound.
     """
-    # `frequencies` is frequency samples of amplitude spectrum
-    # `amplitudes` is power spectral density of amplitude spectrum
-    frequencies, amplitudes = signal.welch(
-        sound, fs, window='hamming',
-        nperseg=nfft, scaling='spectrum', detrend=False)
+    # `frequencies` is frequency samples of power spectrum
+    # `powers` is power spectral density of power spectrum
+    # (the FFTs of the segments run on every core)
+    with sp_fft.set_workers(-1):
+        frequencies, powers = signal.welch(
+            sound, fs, window='hamming',
+            nperseg=nfft, scaling='spectrum', detrend=False)
 
     if lo_hi is not None:   # Limit bandwidth, if requested
         frequencies = frequencies[lo_hi[0]:lo_hi[1]]
-        amplitudes = amplitudes[lo_hi[0]:lo_hi[1]]
+        powers = powers[lo_hi[0]:lo_hi[1]]
+
+    return frequencies, powers
+
 
-    return frequencies, np.power(amplitudes, 0.5)
+def get_amplitude_spectrum(sound, fs, nfft, lo_hi=None):
+    """
+    get_amplitude_spectrum
+    Generates an amplitude spectrum of a selection of sound.
+    """
+    frequencies, powers = get_power_spectrum(sound, fs, nfft, lo_hi)
+    return frequencies, np.sqrt(powers)
 
 
 def frequency2samples(freq, fs, fft):
@@ -65,34 +79,42 @@ def frequency2samples(freq, fs, fft):
     return int(np.floor(freq/(fs/fft)))
 
 
-def get_compensation_filter(playback, recording, fs, nfft, lo, hi):
+def get_compensation_filter(playback, recording, fs, nfft, lo, hi,
+                            playback_power=None, recording_power=None):
     """
     get_compensation_filter
     Generates digital filter that is the inverse of the unwanted filtering. The 
     digital filter is a fir (finite impulse response) filter, and here we use 
-    a Type 1 filter. 
+    a Type 1 filter. A power spectrum that is already known (e.g. of the
+    noise) can be passed in so that it isn't computed again.
     """
-    # Get amplitude spectra
-    _, playback_amp = get_amplitude_spectrum(playback, fs, nfft)
-    _, recording_amp = get_amplitude_spectrum(recording, fs, nfft)
+    # Get power spectra
+    if playback_power is None:
+        _, playback_power = get_power_spectrum(playback, fs, nfft)
+    if recording_power is None:
+        _, recording_power = get_power_spectrum(recording, fs, nfft)
     
-    # This ratio is the inverse of the unwanted filtering
-    amp_ratio = np.divide(playback_amp, recording_amp)
-    # zero out of range frequencies
-    if lo-1 > 0:
-        amp_ratio[0:lo-1] = 0
-    amp_ratio[hi+10: len(amp_ratio)] = 0
+    # This ratio of amplitudes is the inverse of the unwanted filtering. Out of
+    # range frequencies are zero, so only divide within the range. The ratio
+    # of amplitudes is the square root of the ratio of powers, which takes one
+    # square root instead of two
+    in_range = slice(max(lo-1, 0), hi+10)
+    amp_ratio = np.zeros(len(playback_power), dtype=playback_power.dtype)
+    np.divide(playback_power[in_range], recording_power[in_range],
+              out=amp_ratio[in_range])
+    np.sqrt(amp_ratio[in_range], out=amp_ratio[in_range])
     
-    # Make a frequency vector for the filter
-    freq_vector = np.linspace(0, 1, len(amp_ratio))
-    freq_vector = np.multiply(fs/2, freq_vector)
+    # Make a frequency vector for the filter, from 0 to the Nyquist frequency
+    # (which firwin2 needs exactly as the last value)
+    freq_vector = np.linspace(0, fs/2, len(amp_ratio))
     
-    # To produce a Type 1 filter
+    # To produce a Type 1 filter. firwin2 designs it in float64; it's applied
+    # in float32, like the audio
     compensation_filter = signal.firwin2(
         nfft + (nfft % 2 == 0),  # fft must be odd
         freq_vector, amp_ratio, fs=fs)
 
-    return compensation_filter
+    return compensation_filter.astype(np.float32)
 
 
 def compensate(stimulus, compensation_filter):
@@ -101,13 +123,23 @@ def compensate(stimulus, compensation_filter):
     applies the digital filter to the stimulus and adjusts for clipping, if 
     necessary.
     """
-    # Apply the digital filter to the stimulus 
-    compensated_stimulus = signal.lfilter(compensation_filter, 1, stimulus)
+    # Apply the digital filter to the stimulus. The filter is FIR, so this is
+    # a convolution; past a few dozen taps it's faster with FFTs (overlap-add)
+    # than directly, and the FFTs can use every core. Both are float32, so the
+    # result is too
+    stimulus = stimulus.astype(np.float32, copy=False)
+    if len(compensation_filter) < 64:
+        compensated_stimulus = signal.lfilter(
+            compensation_filter, np.float32(1), stimulus)
+    else:
+        with sp_fft.set_workers(-1):
+            compensated_stimulus = signal.oaconvolve(
+                stimulus, compensation_filter, mode='full')[:len(stimulus)]
     
     # If the compensated stimulus would clip, lower the overall amplitude
-    if max(abs(compensated_stimulus)) > 1:
-        compensated_stimulus = compensated_stimulus / (
-                1.1 * max(abs(compensated_stimulus)))
+    peak = np.abs(compensated_stimulus).max()
+    if peak > 1:
+        compensated_stimulus /= 1.1 * peak
 
     return compensated_stimulus
 
@@ -119,12 +151,19 @@ def main(fs, fft, low_freq, high_freq, device, input_channel, output_channel,
     is the starting point of execution in this script
     """
 
-    stimulus, stimulus_fs = sf.read(stimulus_filename)
+    # Audio is read as float32, which halves the memory traffic of float64
+    stimulus, stimulus_fs = sf.read(stimulus_filename, dtype='float32')
     # convert the units of low and high frequency from Hz to samples
     lo = frequency2samples(low_freq, fs, fft)
     hi = frequency2samples(high_freq, fs, fft)
     # generate 2 seconds of noise
     noise = generate_noise(fs)
+    # The noise doesn't change, so get its power spectrum (for the filters)
+    # and its amplitude spectrum (for the plots) once
+    noise_freq, noise_power = get_power_spectrum(noise, fs, fft)
+    stim1_freq = noise_freq[lo:hi]
+    stim1_amp = np.sqrt(noise_power[lo:hi])
+    stim1_db = 20 * np.log10(stim1_amp)
     # set the playback sound to noise for the first compensation cycle
     playback = noise
 
@@ -142,7 +181,8 @@ def main(fs, fft, low_freq, high_freq, device, input_channel, output_channel,
             'Waveform of Recorded Noise')
         # generate a digital filter that compensates for unwanted filtering
         compensation_filter = get_compensation_filter(
-            noise, recording_of_noise, fs, fft, lo, hi)
+            noise, recording_of_noise, fs, fft, lo, hi,
+            playback_power=noise_power)
         # apply the digital filter to the playback sound
         compensated_noise = compensate(playback, compensation_filter)
 
@@ -151,12 +191,13 @@ def main(fs, fft, low_freq, high_freq, device, input_channel, output_channel,
             compensated_noise, fs, device, input_channel, output_channel,
             with_padding=True)
 
-        # Get amplitude spectra and plot
-        stim1_freq, stim1_amp = get_amplitude_spectrum(noise, fs, fft, [lo, hi])
+        # Get amplitude spectrum and plot
         stim2_freq, stim2_amp = get_amplitude_spectrum(
             recording_of_compensated_noise, fs, fft, [lo, hi])
         
-        spectral_difference = 20*np.log10(stim1_amp) - (20*np.log10(stim2_amp) + np.mean(20*np.log10(stim1_amp)) - np.mean(20*np.log10(stim2_amp)))
+        # Convert each spectrum to dB once (the noise's is done above)
+        stim2_db = 20 * np.log10(stim2_amp)
+        spectral_difference = stim1_db - (stim2_db + np.mean(stim1_db) - np.mean(stim2_db))
         max_diff = round(np.max(abs(spectral_difference)), 1)
         average_diff = round(np.mean(abs(spectral_difference)), 1)
         print(f'\nDifference between spectra: \navgerage difference = {average_diff} dB \nmax difference = {max_diff} dB')
@@ -174,7 +215,8 @@ def main(fs, fft, low_freq, high_freq, device, input_channel, output_channel,
         else:
             # get final digital filter that compensates for unwanted filtering
             final_compensation_filter = get_compensation_filter(
-                compensated_noise, noise, fs, fft, lo, hi)
+                compensated_noise, noise, fs, fft, lo, hi,
+                recording_power=noise_power)
 
             # apply the digital filter to the playback stimulus
             print(f'\nCompensating {stimulus_filename}')
@@ -3,11 +3,17 @@ This is the model -  all the data and functions that manipulate the data.
 It passes information to the viewmodel. 
 """
 
+from collections import namedtuple
 import compensation
 import calibration
 import playback
 
 
+# A sensor option: its menu number, name, amplitude units, and the conversion
+# from recorded amplitude to those units
+Sensor = namedtuple('Sensor', 'number name units conversion')
+
+
 class Experiment:
     """
     Experiment
@@ -121,14 +127,18 @@ class TransducerPair:
     This class contains information related to the playback device and sensor.
     """
     sensor_options = [
-        [0, 'accelerometer 100 mV/G (1x gain)', 'm/s^2', 98],
-        [1, 'accelerometer 100 mV/G (10x gain)', 'm/s^2', 9.8],
-        [2, 'accelerometer 100 mV/G (100x gain)', 'm/s^2', 0.98],
-        [3, 'laser 2.5 mm/s/V', 'mm/s', 2.5],
-        [4, 'laser 5 mm/s/V', 'mm/s', 5],
-        [5, 'laser 25 mm/s/V', 'mm/s', 25],
-        [6, 'uncalibrated sensor mV', 'mV', 1000]
+        Sensor(0, 'accelerometer 100 mV/G (1x gain)', 'm/s^2', 98),
+        Sensor(1, 'accelerometer 100 mV/G (10x gain)', 'm/s^2', 9.8),
+        Sensor(2, 'accelerometer 100 mV/G (100x gain)', 'm/s^2', 0.98),
+        Sensor(3, 'laser 2.5 mm/s/V', 'mm/s', 2.5),
+        Sensor(4, 'laser 5 mm/s/V', 'mm/s', 5),
+        Sensor(5, 'laser 25 mm/s/V', 'mm/s', 25),
+        Sensor(6, 'uncalibrated sensor mV', 'mV', 1000)
     ]
+    # Sensor units and conversions, looked up by sensor name
+    units_by_name = {option.name: option.units for option in sensor_options}
+    conversion_by_name = {option.name: option.conversion
+                          for option in sensor_options}
 
     def __init__(self, input_channel, output_channel, sensor_type):
         self.input_channel = input_channel    # sensor channel
@@ -139,18 +149,10 @@ class TransducerPair:
         return self.input_channel, self.output_channel
 
     def get_sensor_units(self):
-        units = ''
-        for option in TransducerPair.sensor_options:
-            if self.sensor_type == option[1]:
-                units = option[2]
-        return units
+        return TransducerPair.units_by_name.get(self.sensor_type, '')
 
     def get_sensor_conversion(self):
-        conversion = 0
-        for option in TransducerPair.sensor_options:
-            if self.sensor_type == option[1]:
-                conversion = option[3]
-        return conversion
+        return TransducerPair.conversion_by_name.get(self.sensor_type, 0)
 
     def __str__(self):
         sensor_amp_units = self.get_sensor_units()
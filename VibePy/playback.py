@@ -3,9 +3,21 @@ playback.py
 This is the playback module. It plays the stimulus for the playback experiment.
 """
 
+import functools
 import numpy as np
 import soundfile as sf
-import sounddevice as sd
+
+
+@functools.lru_cache(maxsize=8)
+def get_padding(padding_len, dtype):
+    """
+    get_padding
+    Returns `padding_len` samples of silence. The silence is cached and shared
+    between calls, so it is read-only.
+    """
+    padding = np.zeros(padding_len, dtype=dtype)
+    padding.flags.writeable = False
+    return padding
 
 
 def play_and_record(playback, fs, device, input_channel, output_channel,
@@ -17,32 +29,37 @@ def play_and_record(playback, fs, device, input_channel, output_channel,
     function assumes that input channel 1 and output channel 1 are used on the 
     audio interface.
     """
+    import sounddevice as sd    # Deferred: importing initializes PortAudio
 
     if with_padding:
         # If requested, add padding to the playback. Helps prevent it from
         # getting cut off in the recording
-        padding = np.zeros(round(fs / 6))
+        padding = get_padding(round(fs / 6), playback.dtype)
         padded_playback = np.concatenate([playback, padding, padding])
     else:
         padded_playback = playback
 
-    # Play and record the playback sound
+    # Play and record the playback sound. playrec returns immediately while
+    # the buffer is still being filled, so wait before using the recording
     recording = sd.playrec(padded_playback, fs,
                            device=device,
                            input_mapping=[input_channel],
-                           output_mapping=[output_channel])[:, 0]
+                           output_mapping=[output_channel])
     sd.wait()
+    recording = recording[:, 0]
 
     if with_padding:    # Fix the recording length
         diff_samps = len(recording) - len(playback)
 
         if diff_samps > 0:
             # If the recording was longer, trim it
-            recording = recording[diff_samps:]
+            recording = recording[-len(playback):]
 
         elif diff_samps < 0:
             # If the recording was shorter, pad it with silence
-            recording = np.concatenate([recording, np.zeros(diff_samps)])
+            padded_recording = np.zeros(len(playback), dtype=recording.dtype)
+            padded_recording[:len(recording)] = recording
+            recording = padded_recording
 
     return recording
 
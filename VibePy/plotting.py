@@ -3,10 +3,73 @@ plotting.py
 This is the plotting module. It plots graphs with a common style.
 """
 
+import functools
 import numpy as np
-import matplotlib.pyplot as plt
 
-plt.rcParams['font.family'] = 'Arial'   # Set this (once) globally
+# Backends that render without a window (e.g. MPLBACKEND=Agg for scripted runs)
+non_interactive_backends = frozenset(
+    {'agg', 'cairo', 'pdf', 'pgf', 'ps', 'svg', 'template'})
+
+
+@functools.lru_cache(maxsize=1)
+def get_pyplot():
+    """
+    get_pyplot
+    Imports pyplot the first time something is plotted, so that runs which
+    don't plot don't pay for setting up a backend and the font manager.
+    """
+    import matplotlib.pyplot as plt     # Deferred: importing sets up a backend
+    plt.rcParams['font.family'] = 'Arial'   # Set this (once) globally
+    return plt
+
+
+def is_interactive():
+    """
+    is_interactive
+    Returns whether figures are shown in windows (rather than only rendered).
+    """
+    return get_pyplot().get_backend().lower() not in non_interactive_backends
+
+
+def show(fig):
+    """
+    show
+    Shows a figure. With a non-interactive backend there is nothing to show, so
+    the figure is closed instead of piling up (it can still be saved).
+    """
+    plt = get_pyplot()
+    if not is_interactive():
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+def get_envelope(time, stim, num_buckets):
+    """
+    get_envelope
+    Reduces a waveform to the minimum and maximum of each of `num_buckets`
+    equal buckets of samples. At about one bucket per pixel it draws the same
+    as the full waveform, with far fewer points.
+    """
+    bucket_len = -(-len(stim) // num_buckets)   # Round up, to cover every sample
+    starts = np.arange(0, len(stim), bucket_len)
+    envelope = np.empty((len(starts), 2), dtype=stim.dtype)
+    envelope[:, 0] = np.minimum.reduceat(stim, starts)
+    envelope[:, 1] = np.maximum.reduceat(stim, starts)
+    return np.repeat(time[starts], 2), envelope.ravel()
+
+
+def amplitude2decibels(amp):
+    """
+    amplitude2decibels
+    Converts amplitudes to decibels. Amplitudes of zero or less have no level
+    in decibels, so they become NaN (drawn as gaps) without taking the log.
+    """
+    amp = np.asarray(amp, dtype=float)
+    decibels = np.full(amp.shape, np.nan)
+    np.log10(amp, out=decibels, where=amp > 0)
+    decibels *= 20
+    return decibels
 
 
 def plot_waveforms(fs, stim1, stim2, ylabel, title1, title2):
@@ -15,21 +78,37 @@ def plot_waveforms(fs, stim1, stim2, ylabel, title1, title2):
     plots vertically stacked waveforms of stimuli
     """
 
-    # Convert samples to time
-    time = np.linspace(0, (len(stim1) / fs), len(stim1))
+    plt = get_pyplot()
+
+    # Convert samples to time (sample n is at n / fs)
+    time = np.arange(len(stim1)) * (1.0 / fs)
 
     fig, axs = plt.subplots(2, 1, layout='constrained')
     fig.set_figwidth(10)
     fig.set_figheight(7)
-    axs[0].plot(time, stim1)
+
+    # Long waveforms have many samples per pixel, so when they are only
+    # rendered, draw just their envelope. Shown ones keep every sample, so
+    # that zooming in shows the waveform
+    width_px = round(fig.get_figwidth() * fig.dpi)
+    time1 = time2 = time
+    if not is_interactive():
+        if len(stim1) > 4 * width_px:
+            time1, stim1 = get_envelope(time, stim1, width_px)
+        if len(stim2) > 4 * width_px:
+            time2, stim2 = get_envelope(time, stim2, width_px)
+
+    axs[0].plot(time1, stim1)
     axs[0].set_xlabel('Time (s)', fontsize=13)
     axs[0].set_ylabel(ylabel, fontsize=13)
     axs[0].set_title(title1, fontsize=16)
-    axs[1].plot(time, stim2)
+    axs[1].plot(time2, stim2)
     axs[1].set_xlabel('Time (s)', fontsize=13)
     axs[1].set_ylabel(ylabel, fontsize=13)
     axs[1].set_title(title2, fontsize=16)
-    plt.show()
+    show(fig)
+
+    return fig
 
 
 def plot_amplitude_spectra(freqs, amps, names, caption=None):
@@ -38,22 +117,31 @@ def plot_amplitude_spectra(freqs, amps, names, caption=None):
     plots amplitude spectra of stimuli with frequency (Hz) on the x-axis and
     relative decibels on the y-axis
     """
+    plt = get_pyplot()
 
-    # Determine the plot's y-axis range
-    plt_min = min([min(amp - 0.2*min(amp)) for amp in amps])
-    plt_max = max([max(amp + 0.2*min(amp)) for amp in amps])
+    # Determine the plot's y-axis range (with NumPy's reductions, rather than
+    # Python's min and max over every sample) from the amplitudes that can be
+    # drawn in decibels
+    positive_amps = [amp[amp > 0] for amp in amps]
+    plt_min = min((amp.min() - 0.2*amp.min() for amp in positive_amps
+                   if amp.size), default=None)
+    plt_max = max((amp.max() + 0.2*amp.min() for amp in positive_amps
+                   if amp.size), default=None)
 
-    # Plot
-    plt.figure(figsize=(10, 7))
+    # Plot, calling the axes directly rather than through pyplot's state
+    fig, ax = plt.subplots(figsize=(10, 7))
     for freq, amp, name in zip(freqs, amps, names):
-        plt.plot(freq, 20 * np.log10(amp), label=name)
-    plt.ylim(20 * np.log10(plt_min), 20 * np.log10(plt_max))
-    plt.xlabel('Frequency [Hz]', fontsize=13)
-    plt.ylabel('Relative amplitude (dB)', fontsize=13)
-    plt.title('Amplitude spectra of ' +
-              ', '.join([name for name in names[:-1]]) +
-              f' and {names[-1]}', fontsize=16)
-    plt.legend(fontsize=12)
+        ax.plot(freq, amplitude2decibels(amp), label=name)
+    if plt_min is not None:
+        ax.set_ylim(amplitude2decibels(plt_min), amplitude2decibels(plt_max),
+                    emit=False)
+    ax.set_xlabel('Frequency [Hz]', fontsize=13)
+    ax.set_ylabel('Relative amplitude (dB)', fontsize=13)
+    ax.set_title(f'Amplitude spectra of {", ".join(names[:-1])} and {names[-1]}',
+                 fontsize=16)
+    ax.legend(fontsize=12)
     if caption is not None:
-        plt.figtext(0.5, 0.01, f'{caption}', wrap=True, horizontalalignment='center')
-    plt.show()
+        fig.text(0.5, 0.01, f'{caption}', wrap=True, horizontalalignment='center')
+    show(fig)
+
+    return fig